@@ -1,13 +1,12 @@
 import logging
 import uuid
-from pathlib import Path
 from typing import Optional
 
 from telegram import Update
 from telegram.ext import Application, CallbackContext, CommandHandler, MessageHandler, filters
 
 from app import config
-from app.tasks import enqueue_job, process_video
+from app.tasks import enqueue_job
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,7 +15,8 @@ logger = logging.getLogger(__name__)
 def _is_supported(filename: Optional[str]) -> bool:
     if not filename:
         return False
-    return Path(filename).suffix.lower() in config.SUPPORTED_EXTENSIONS
+    dot = filename.rfind(".")
+    return dot >= 0 and filename[dot:].lower() in config.SUPPORTED_EXTENSIONS
 
 
 async def start(update: Update, context: CallbackContext) -> None:
@@ -57,13 +57,14 @@ async def handle_video(update: Update, context: CallbackContext) -> None:
         return
 
     job_id = str(uuid.uuid4())
-    position = enqueue_job(job_id=job_id, chat_id=message.chat_id, file_name=file_name)
+    position = enqueue_job(
+        job_id=job_id, chat_id=message.chat_id, file_id=file_id, file_name=file_name
+    )
 
     await message.reply_text(
         f"Видео принято в обработку. Ваша позиция в общей очереди: {position}. "
         "Ожидайте статус обработки."
     )
-    process_video.delay(job_id, message.chat_id, file_id, file_name)
 
 
 def main() -> None:
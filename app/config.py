@@ -7,18 +7,34 @@ def _clamp_chunk_duration(value: int) -> int:
     return max(300, min(600, value))
 
 
+def _available_cpus() -> int:
+    """Count the CPUs this process may run on, honouring container cpusets."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available outside Linux
+        return os.cpu_count() or 1
+
+
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto").lower()
+# Per device, so a GPU setting never reaches a worker that fell back to CPU.
+WHISPER_GPU_COMPUTE_TYPE = os.getenv("WHISPER_GPU_COMPUTE_TYPE") or "int8_float16"
+WHISPER_CPU_COMPUTE_TYPE = os.getenv("WHISPER_CPU_COMPUTE_TYPE") or "int8"
+WHISPER_BATCH_SIZE = max(1, int(os.getenv("WHISPER_BATCH_SIZE", "8")))
+AVAILABLE_CPUS = _available_cpus()
+# Default to four threads per worker, matching faster-whisper's own cpu_threads default.
+WHISPER_CPU_WORKERS = max(1, int(os.getenv("WHISPER_CPU_WORKERS") or AVAILABLE_CPUS // 4))
 
 CHUNK_DURATION_SECONDS = _clamp_chunk_duration(
     int(os.getenv("CHUNK_DURATION_SECONDS", "600"))
 )
 ENABLE_SRT = os.getenv("ENABLE_SRT", "true").lower() in {"1", "true", "yes", "on"}
 
-SUPPORTED_EXTENSIONS = {".mp4", ".mov", ".mkv", ".avi"}
+SUPPORTED_EXTENSIONS = frozenset({".mp4", ".mov", ".mkv", ".avi"})
 
 TEMP_DIR = Path(os.getenv("TEMP_DIR", "/app/data"))
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
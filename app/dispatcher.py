@@ -0,0 +1,19 @@
+import logging
+
+from app import config
+from app.tasks import dispatch_jobs
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    if not config.TELEGRAM_BOT_TOKEN:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN is not configured")
+
+    logger.info("Starting queue dispatcher")
+    dispatch_jobs()
+
+
+if __name__ == "__main__":
+    main()
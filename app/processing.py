@@ -1,18 +1,36 @@
 import logging
 import shutil
 import subprocess
+import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable, Iterable, List, Optional, Sequence
+from typing import Callable, Iterable, List, Optional
 
-import whisper
-from pydub import AudioSegment
+import ctranslate2
+import numpy as np
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 
 from app import config
 
 logger = logging.getLogger(__name__)
 
+SAMPLE_RATE = 16000
+_READ_BLOCK_SIZE = 1 << 20
+
+# Zero-padded strings for timestamp fields, so formatting is a table lookup.
+_TWO_DIGITS = [f"{i:02d}" for i in range(100)]
+_THREE_DIGITS = [f"{i:03d}" for i in range(1000)]
+
+# Silero VAD settings for WhisperModel.transcribe, whose default minimum silence is
+# 2 s. The batched pipeline already defaults to a stricter 160 ms, so it keeps that.
+_VAD_PARAMETERS = {"min_silence_duration_ms": 500}
+
+_model: Optional[WhisperModel] = None
+_model_name: Optional[str] = None
+_model_device: Optional[str] = None
+
 
 @dataclass
 class Segment:
@@ -43,51 +61,74 @@ def download_video(
     return video_path
 
 
-def extract_audio(video_path: Path, audio_path: Path) -> None:
-    """Extract mono 16 kHz WAV audio from a video file."""
+def load_audio(video_path: Path) -> np.ndarray:
+    """Decode the video's audio track to mono 16 kHz float32 samples in memory."""
+    # Only the first audio stream is mapped, so the video track is never decoded
+    # and hardware video decoding would not help here.
     command = [
         "ffmpeg",
-        "-y",
+        "-nostats",
+        "-loglevel",
+        "error",
+        "-threads",
+        "0",
         "-i",
         str(video_path),
+        "-map",
+        "0:a:0",
         "-vn",
+        "-sn",
+        "-dn",
+        "-af",
+        "aresample=resampler=soxr",
         "-ac",
         "1",
         "-ar",
-        "16000",
-        str(audio_path),
+        str(SAMPLE_RATE),
+        "-f",
+        "f32le",
+        "pipe:1",
     ]
     logger.info("Extracting audio via ffmpeg")
-    result = subprocess.run(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
-    )
-    if result.returncode != 0:
-        logger.error("ffmpeg failed: %s", result.stderr.decode("utf-8", "ignore"))
-        raise RuntimeError("Failed to extract audio with ffmpeg")
-
-
-def split_audio(audio_path: Path, chunk_dir: Path, chunk_duration_seconds: int) -> List[Path]:
-    """Split long audio into sequential chunks."""
-    chunk_dir.mkdir(parents=True, exist_ok=True)
-    logger.info("Splitting audio into %s-second chunks", chunk_duration_seconds)
-    audio = AudioSegment.from_file(audio_path)
-    chunk_length_ms = chunk_duration_seconds * 1000
-    chunks: List[Path] = []
-    for index, start_ms in enumerate(range(0, len(audio), chunk_length_ms)):
-        end_ms = min(start_ms + chunk_length_ms, len(audio))
-        chunk_audio = audio[start_ms:end_ms]
-        chunk_path = chunk_dir / f"chunk_{index:04d}.wav"
-        chunk_audio.export(chunk_path, format="wav", parameters=["-ac", "1", "-ar", "16000"])
-        chunks.append(chunk_path)
-    return chunks
+    data = _run_ffmpeg(command, "Failed to extract audio with ffmpeg")
+    return np.frombuffer(data, dtype=np.float32)
+
+
+def split_audio(audio: np.ndarray, chunk_duration_seconds: int) -> List[np.ndarray]:
+    """Split audio samples into sequential chunks (views, no copies)."""
+    chunk_size = chunk_duration_seconds * SAMPLE_RATE
+    return [audio[start : start + chunk_size] for start in range(0, len(audio), chunk_size)]
+
+
+def _run_ffmpeg(command: List[str], error_message: str) -> bytearray:
+    """Run ffmpeg and return its stdout, read into a single growing buffer."""
+    output = bytearray()
+    block = bytearray(_READ_BLOCK_SIZE)
+    view = memoryview(block)
+    # stderr goes to a temp file so a chatty ffmpeg can never block on a full pipe.
+    with tempfile.TemporaryFile() as stderr:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr) as process:
+            while True:
+                read = process.stdout.readinto(block)
+                if not read:
+                    break
+                output += view[:read]
+        if process.returncode != 0:
+            stderr.seek(0)
+            tail = stderr.read()[-4096:]
+            logger.error("ffmpeg failed: %s", tail.decode("utf-8", "ignore"))
+            raise RuntimeError(error_message)
+    return output
+
+
+def _two_digits(value: int) -> str:
+    return _TWO_DIGITS[value] if value < 100 else str(value)
 
 
 def _format_timestamp(seconds: float) -> str:
-    total_seconds = int(seconds)
-    hours = total_seconds // 3600
-    minutes = (total_seconds % 3600) // 60
-    secs = total_seconds % 60
-    return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, secs = divmod(remainder, 60)
+    return _two_digits(hours) + ":" + _TWO_DIGITS[minutes] + ":" + _TWO_DIGITS[secs]
 
 
 def _format_srt_timestamp(seconds: float) -> str:
@@ -95,58 +136,165 @@ def _format_srt_timestamp(seconds: float) -> str:
     hours, remainder = divmod(millis, 3600_000)
     minutes, remainder = divmod(remainder, 60_000)
     secs, millis = divmod(remainder, 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+    return (
+        _two_digits(hours)
+        + ":"
+        + _TWO_DIGITS[minutes]
+        + ":"
+        + _TWO_DIGITS[secs]
+        + ","
+        + _THREE_DIGITS[millis]
+    )
+
+
+def _resolve_device() -> str:
+    if config.WHISPER_DEVICE in {"cuda", "cpu"}:
+        return config.WHISPER_DEVICE
+    # Probed lazily: CUDA must not be initialised in the Celery parent before it forks.
+    return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+
+
+def get_model(model_name: str) -> WhisperModel:
+    """Return the worker-wide Whisper model, loading it on first use."""
+    global _model, _model_name, _model_device
+    if _model is None or _model_name != model_name:
+        device = _resolve_device()
+        if device == "cuda":
+            compute_type = config.WHISPER_GPU_COMPUTE_TYPE
+            options = {}
+        else:
+            # One CTranslate2 worker per transcription thread, so chunks decode in parallel.
+            compute_type = config.WHISPER_CPU_COMPUTE_TYPE
+            workers = config.WHISPER_CPU_WORKERS
+            options = {
+                "num_workers": workers,
+                "cpu_threads": max(1, config.AVAILABLE_CPUS // workers),
+            }
+        logger.info("Loading Whisper model %s on %s (%s)", model_name, device, compute_type)
+        _model = WhisperModel(model_name, device=device, compute_type=compute_type, **options)
+        _model_name = model_name
+        _model_device = device
+    return _model
 
 
-def transcribe_chunks(
-    chunk_paths: Sequence[Path],
+def transcribe_audio(
+    audio: np.ndarray,
     model_name: str,
+    chunk_duration_seconds: int,
+    batch_size: int,
     progress_callback: Optional[Callable[[int, int], None]] = None,
 ) -> List[Segment]:
-    """Run Whisper on each chunk and aggregate segments with corrected timestamps."""
-    if not chunk_paths:
+    """Transcribe the whole audio buffer.
+
+    On GPU the buffer goes through batched inference; on CPU it is split into
+    ``chunk_duration_seconds``-long chunks transcribed in parallel. Progress is
+    reported in those chunks either way.
+    """
+    if not len(audio):
         return []
 
-    logger.info("Loading Whisper model %s", model_name)
-    model = whisper.load_model(model_name)
+    model = get_model(model_name)
+    if _model_device == "cuda":
+        return _transcribe_batched(
+            model, audio, chunk_duration_seconds, batch_size, progress_callback
+        )
+    return _transcribe_parallel(model, audio, chunk_duration_seconds, progress_callback)
+
+
+def _transcribe_batched(
+    model: WhisperModel,
+    audio: np.ndarray,
+    chunk_duration_seconds: int,
+    batch_size: int,
+    progress_callback: Optional[Callable[[int, int], None]],
+) -> List[Segment]:
+    pipeline = BatchedInferencePipeline(model=model)
+    segments_iter, _ = pipeline.transcribe(
+        audio,
+        language="ru",
+        batch_size=batch_size,
+        # Segment-level timestamps; the batched default yields one cue per VAD chunk.
+        without_timestamps=False,
+        vad_filter=True,
+    )
+
+    chunk_size = chunk_duration_seconds * SAMPLE_RATE
+    total = -(-len(audio) // chunk_size)
+    done = 0
     segments: List[Segment] = []
-    offset = 0.0
-
-    total = len(chunk_paths)
-    for index, chunk_path in enumerate(chunk_paths, start=1):
-        logger.info("Transcribing %s", chunk_path.name)
-        result = model.transcribe(str(chunk_path), language="ru")
-        for seg in result.get("segments", []):
-            segments.append(
-                Segment(
-                    start=seg["start"] + offset,
-                    end=seg["end"] + offset,
-                    text=seg["text"].strip(),
-                )
-            )
-        audio = AudioSegment.from_file(chunk_path)
-        offset += len(audio) / 1000.0
-        if progress_callback:
-            progress_callback(index, total)
+    # Segments are decoded lazily while iterating.
+    for seg in segments_iter:
+        segments.append(Segment(start=seg.start, end=seg.end, text=seg.text.strip()))
+        reached = min(int(seg.end // chunk_duration_seconds), total)
+        if progress_callback and reached > done:
+            done = reached
+            progress_callback(done, total)
+    if progress_callback and done < total:
+        progress_callback(total, total)
     return segments
 
 
-def write_transcription_txt(segments: Iterable[Segment], target: Path) -> None:
-    with target.open("w", encoding="utf-8") as handle:
-        for seg in segments:
-            handle.write(
-                f"[{_format_timestamp(seg.start)} - {_format_timestamp(seg.end)}] {seg.text}\n"
-            )
+def _transcribe_parallel(
+    model: WhisperModel,
+    audio: np.ndarray,
+    chunk_duration_seconds: int,
+    progress_callback: Optional[Callable[[int, int], None]],
+) -> List[Segment]:
+    # Audio is only cut at chunk boundaries: extra cuts split words and lose
+    # decoding context. Short files still get each worker's full thread count.
+    chunks = split_audio(audio, chunk_duration_seconds)
+    total = len(chunks)
+    results: List[List[Segment]] = [[] for _ in chunks]
+
+    with ThreadPoolExecutor(max_workers=config.WHISPER_CPU_WORKERS) as executor:
+        futures = {
+            executor.submit(
+                _transcribe_chunk, model, chunk, index * chunk_duration_seconds
+            ): index
+            for index, chunk in enumerate(chunks)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if progress_callback:
+                progress_callback(done, total)
+
+    return [seg for chunk_segments in results for seg in chunk_segments]
+
 
+def _transcribe_chunk(model: WhisperModel, chunk: np.ndarray, offset: float) -> List[Segment]:
+    segments_iter, _ = model.transcribe(
+        chunk,
+        language="ru",
+        beam_size=5,
+        vad_filter=True,
+        vad_parameters=_VAD_PARAMETERS,
+    )
+    # Segments are decoded lazily, so materialize them inside the worker thread.
+    return [
+        Segment(start=seg.start + offset, end=seg.end + offset, text=seg.text.strip())
+        for seg in segments_iter
+    ]
 
-def write_srt(segments: Iterable[Segment], target: Path) -> None:
-    with target.open("w", encoding="utf-8") as handle:
-        for index, seg in enumerate(segments, start=1):
-            start = _format_srt_timestamp(seg.start)
-            end = _format_srt_timestamp(seg.end)
-            handle.write(f"{index}\n")
-            handle.write(f"{start} --> {end}\n")
-            handle.write(f"{seg.text}\n\n")
+
+def write_outputs(
+    segments: Iterable[Segment], txt_path: Path, srt_path: Optional[Path] = None
+) -> None:
+    """Write the TXT transcription and, if requested, the SRT file in one pass."""
+    txt_parts: List[str] = []
+    srt_parts: List[str] = []
+    for index, seg in enumerate(segments, start=1):
+        txt_parts.append(
+            f"[{_format_timestamp(seg.start)} - {_format_timestamp(seg.end)}] {seg.text}\n"
+        )
+        if srt_path is not None:
+            srt_parts.append(
+                f"{index}\n"
+                f"{_format_srt_timestamp(seg.start)} --> {_format_srt_timestamp(seg.end)}\n"
+                f"{seg.text}\n\n"
+            )
+    txt_path.write_text("".join(txt_parts), encoding="utf-8")
+    if srt_path is not None:
+        srt_path.write_text("".join(srt_parts), encoding="utf-8")
 
 
 def clean_workdir(path: Path) -> None:
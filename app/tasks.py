@@ -1,11 +1,12 @@
 import asyncio
 import logging
 import time
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Any, Coroutine, Optional, TypeVar
+from typing import Any, Coroutine, List, Optional, Tuple, TypeVar
 
-import httpx
 from celery import Celery
+from celery.signals import worker_process_init
 from telegram import Bot
 from telegram.constants import ParseMode
 from telegram.request import HTTPXRequest
@@ -23,23 +24,43 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    broker_transport_options={"visibility_timeout": 60 * 60},
+    # Jobs can run for hours; with late acks the timeout must outlive them
+    # or Redis redelivers a task that is still being processed.
+    broker_transport_options={"visibility_timeout": 12 * 60 * 60},
     task_serializer="json",
     result_serializer="json",
     accept_content=["json"],
     task_track_started=True,
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    # The dispatcher runs one job at a time, so extra children would only load
+    # more copies of the model.
+    worker_concurrency=1,
+    # Children load Whisper in worker_process_init before reporting that they are
+    # up; the 4 s default would kill and respawn them while the model loads.
+    worker_proc_alive_timeout=300,
 )
 
 QUEUE_KEY = "recognbot:queue"
+PROCESSING_KEY = "recognbot:processing"
 QUEUE_META_PREFIX = "recognbot:queue:meta:"
-QUEUE_NOTIFY_INTERVAL = 30
 TRANSCRIBE_NOTIFY_STEPS = 5
 
 _loop: Optional[asyncio.AbstractEventLoop] = None
 _shared_bot: Optional[Bot] = None
+_shared_redis: Optional[Redis] = None
 _T = TypeVar("_T")
 
 
+@worker_process_init.connect
+def _preload_model(**_: Any) -> None:
+    # Load Whisper once per worker process instead of once per task.
+    try:
+        processing.get_model(config.WHISPER_MODEL)
+    except Exception:
+        logger.exception("Failed to preload Whisper model %s", config.WHISPER_MODEL)
+
+
 def _get_loop() -> asyncio.AbstractEventLoop:
     global _loop
     if _loop is None or _loop.is_closed():
@@ -67,44 +88,48 @@ def _get_bot() -> Bot:
     global _shared_bot
     if _shared_bot is None:
         request = HTTPXRequest(
-            connection_pool_limits=httpx.Limits(
-                max_connections=20,
-                max_keepalive_connections=20,
-                keepalive_expiry=60.0,
-            ),
+            connection_pool_size=16,
             pool_timeout=30.0,
+            http_version="1.1",
         )
         _shared_bot = Bot(token=config.TELEGRAM_BOT_TOKEN, request=request)
     return _shared_bot
 
 
 def _get_redis() -> Redis:
-    return Redis.from_url(config.REDIS_URL, decode_responses=True)
+    global _shared_redis
+    if _shared_redis is None:
+        # The client keeps its own connection pool, so share it across calls.
+        _shared_redis = Redis.from_url(
+            config.REDIS_URL, decode_responses=True, socket_keepalive=True
+        )
+    return _shared_redis
 
 
-def enqueue_job(job_id: str, chat_id: int, file_name: Optional[str]) -> int:
+def enqueue_job(
+    job_id: str, chat_id: int, file_id: str, file_name: Optional[str]
+) -> int:
     client = _get_redis()
-    position = client.rpush(QUEUE_KEY, job_id)
-    client.hset(
+    pipe = client.pipeline()
+    # Store the metadata first so the dispatcher never pops a job without it.
+    pipe.hset(
         f"{QUEUE_META_PREFIX}{job_id}",
         mapping={
             "chat_id": chat_id,
+            "file_id": file_id,
             "file_name": file_name or "",
             "enqueued_at": int(time.time()),
         },
     )
+    pipe.rpush(QUEUE_KEY, job_id)
+    pipe.llen(PROCESSING_KEY)
+    _, waiting, in_flight = pipe.execute()
+    # The job being processed counts as the first place in the queue.
+    position = waiting + (1 if in_flight else 0)
     logger.info("Enqueued job %s at position %s", job_id, position)
     return position
 
 
-def _remove_job(job_id: str) -> None:
-    client = _get_redis()
-    removed = client.lrem(QUEUE_KEY, 0, job_id)
-    client.delete(f"{QUEUE_META_PREFIX}{job_id}")
-    if removed:
-        logger.info("Removed job %s from queue", job_id)
-
-
 def _send_status(bot: Bot, chat_id: int, text: str) -> None:
     try:
         _run_async(bot.send_message(chat_id=chat_id, text=text))
@@ -112,36 +137,107 @@ def _send_status(bot: Bot, chat_id: int, text: str) -> None:
         logger.exception("Failed to send status message to user")
 
 
-def _wait_for_turn(job_id: str, bot: Bot, chat_id: int) -> None:
+def _notify_queue_positions(bot: Bot) -> None:
     client = _get_redis()
-    last_notified = 0.0
-    last_position: Optional[int] = None
+    waiting = client.lrange(QUEUE_KEY, 0, -1)
+    if not waiting:
+        return
+    pipe = client.pipeline(transaction=False)
+    pipe.llen(PROCESSING_KEY)
+    for job_id in waiting:
+        pipe.hget(f"{QUEUE_META_PREFIX}{job_id}", "chat_id")
+    in_flight, *chat_ids = pipe.execute()
+    for position, chat_id in enumerate(chat_ids, start=1 + (1 if in_flight else 0)):
+        if chat_id:
+            _send_status(
+                bot,
+                int(chat_id),
+                f"Ожидание обработки. Ваша позиция в очереди: {position}.",
+            )
+
 
+def _finish_job(job_id: str) -> None:
+    pipe = _get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 0, job_id)
+    pipe.delete(f"{QUEUE_META_PREFIX}{job_id}")
+    pipe.execute()
+
+
+def _recover_jobs() -> None:
+    """Settle jobs a previous dispatcher left in the processing list."""
+    client = _get_redis()
+    # Walk newest first so re-queued jobs end up at the head in their original order.
+    for job_id in reversed(client.lrange(PROCESSING_KEY, 0, -1)):
+        if client.hget(f"{QUEUE_META_PREFIX}{job_id}", "dispatched"):
+            logger.info("Waiting for job %s dispatched by a previous run", job_id)
+            process_video.AsyncResult(job_id).get(propagate=False)
+            _finish_job(job_id)
+        else:
+            logger.warning("Re-queueing job %s that was never dispatched", job_id)
+            pipe = client.pipeline()
+            pipe.lrem(PROCESSING_KEY, 0, job_id)
+            pipe.lpush(QUEUE_KEY, job_id)
+            pipe.execute()
+
+
+def dispatch_jobs() -> None:
+    """Hand queued jobs to Celery one at a time, in FIFO order.
+
+    Blocks on the Redis queue instead of polling it and waits for each job to
+    finish before taking the next one, so the queue stays strictly sequential.
+    A job stays in the processing list until it finishes, so a restarted
+    dispatcher can pick it up again.
+    """
+    client = _get_redis()
+    bot = _get_bot()
+    _recover_jobs()
+    logger.info("Dispatcher is waiting for jobs")
     while True:
-        head = client.lindex(QUEUE_KEY, 0)
-        if head == job_id:
-            logger.info("Job %s is now at the head of the queue", job_id)
-            return
-
-        position = client.lpos(QUEUE_KEY, job_id)
-        if position is None:
-            # Reinsert the job at the end if it disappeared unexpectedly.
-            logger.warning("Job %s not found in queue; reinserting", job_id)
-            client.rpush(QUEUE_KEY, job_id)
-            position = client.lpos(QUEUE_KEY, job_id)
-
-        if position is not None:
-            position_display = position + 1
-            now = time.time()
-            if position_display != last_position or now - last_notified >= QUEUE_NOTIFY_INTERVAL:
-                _send_status(
-                    bot,
-                    chat_id,
-                    f"Ожидание обработки. Ваша позиция в очереди: {position_display}.",
+        job_id = client.blmove(QUEUE_KEY, PROCESSING_KEY, timeout=0, src="LEFT", dest="RIGHT")
+        meta_key = f"{QUEUE_META_PREFIX}{job_id}"
+        meta = client.hgetall(meta_key)
+        try:
+            chat_id = int(meta["chat_id"])
+            file_id = meta["file_id"]
+        except (KeyError, ValueError):
+            # Covers missing metadata and jobs enqueued before file_id was stored.
+            logger.warning("Job %s has no usable metadata; skipping", job_id)
+            _finish_job(job_id)
+            continue
+
+        _notify_queue_positions(bot)
+        logger.info("Dispatching job %s", job_id)
+        # The job id doubles as the task id, so a restarted dispatcher can find the result.
+        result = process_video.apply_async(
+            args=(job_id, chat_id, file_id, meta.get("file_name") or None),
+            task_id=job_id,
+        )
+        client.hset(meta_key, "dispatched", 1)
+        result.get(propagate=False)
+        logger.info("Job %s finished with state %s", job_id, result.state)
+        _finish_job(job_id)
+
+
+def _send_documents(bot: Bot, chat_id: int, documents: List[Tuple[Path, str]]) -> None:
+    """Upload result files concurrently; each item is a (path, caption) pair."""
+
+    async def _upload_all(handles: List[Any]) -> None:
+        await asyncio.gather(
+            *(
+                bot.send_document(
+                    chat_id=chat_id,
+                    document=handle,
+                    filename=path.name,
+                    caption=caption,
+                    parse_mode=ParseMode.HTML,
                 )
-                last_position = position_display
-                last_notified = now
-        time.sleep(5)
+                for handle, (path, caption) in zip(handles, documents)
+            )
+        )
+
+    with ExitStack() as stack:
+        handles = [stack.enter_context(path.open("rb")) for path, _ in documents]
+        _run_async(_upload_all(handles))
 
 
 def _send_failure(bot: Bot, chat_id: int, reason: str) -> None:
@@ -162,13 +258,10 @@ def process_video(
     bot = _get_bot()
     work_dir = config.TEMP_DIR / f"{chat_id}_{int(time.time())}"
     video_path: Optional[Path] = None
-    audio_path: Optional[Path] = None
     transcription_txt: Optional[Path] = None
     transcription_srt: Optional[Path] = None
 
     try:
-        _wait_for_turn(job_id, bot, chat_id)
-
         total_steps = 5
         current_step = 1
         _send_status(
@@ -177,7 +270,6 @@ def process_video(
             f"Обработка началась. Шаг {current_step}/{total_steps}: скачиваем видео (0%).",
         )
         video_path = processing.download_video(bot, file_id, work_dir, file_name, _run_async)
-        audio_path = work_dir / "audio.wav"
 
         current_step += 1
         _send_status(
@@ -185,19 +277,16 @@ def process_video(
             chat_id,
             f"Шаг {current_step}/{total_steps}: извлекаем аудио из видео (25%).",
         )
-        processing.extract_audio(video_path, audio_path)
+        audio = processing.load_audio(video_path)
+        chunk_size = config.CHUNK_DURATION_SECONDS * processing.SAMPLE_RATE
+        chunk_count = -(-len(audio) // chunk_size)
 
         current_step += 1
-        chunks = processing.split_audio(
-            audio_path=audio_path,
-            chunk_dir=work_dir / "chunks",
-            chunk_duration_seconds=config.CHUNK_DURATION_SECONDS,
-        )
 
         _send_status(
             bot,
             chat_id,
-            f"Шаг {current_step}/{total_steps}: аудио разделено на {len(chunks)} частей (40%).",
+            f"Шаг {current_step}/{total_steps}: аудио разделено на {chunk_count} частей (40%).",
         )
 
         current_step += 1
@@ -217,18 +306,18 @@ def process_video(
                 )
                 progress_state["last_percent"] = percent
 
-        segments = processing.transcribe_chunks(
-            chunks,
+        segments = processing.transcribe_audio(
+            audio,
             config.WHISPER_MODEL,
+            chunk_duration_seconds=config.CHUNK_DURATION_SECONDS,
+            batch_size=config.WHISPER_BATCH_SIZE,
             progress_callback=_on_transcribe_progress,
         )
 
         transcription_txt = work_dir / "transcription.txt"
-        processing.write_transcription_txt(segments, transcription_txt)
-
         if config.ENABLE_SRT:
             transcription_srt = work_dir / "transcription.srt"
-            processing.write_srt(segments, transcription_srt)
+        processing.write_outputs(segments, transcription_txt, transcription_srt)
 
         _send_status(
             bot,
@@ -237,26 +326,10 @@ def process_video(
         )
 
         current_step += 1
-        _run_async(
-            bot.send_document(
-                chat_id=chat_id,
-                document=transcription_txt.open("rb"),
-                filename=transcription_txt.name,
-                caption="Результат распознавания",
-                parse_mode=ParseMode.HTML,
-            )
-        )
-
+        documents = [(transcription_txt, "Результат распознавания")]
         if transcription_srt and transcription_srt.exists():
-            _run_async(
-                bot.send_document(
-                    chat_id=chat_id,
-                    document=transcription_srt.open("rb"),
-                    filename=transcription_srt.name,
-                    caption="SRT файл с субтитрами",
-                    parse_mode=ParseMode.HTML,
-                )
-            )
+            documents.append((transcription_srt, "SRT файл с субтитрами"))
+        _send_documents(bot, chat_id, documents)
         _send_status(
             bot,
             chat_id,
@@ -270,5 +343,4 @@ def process_video(
             raise
         raise self.retry(exc=exc, countdown=30, max_retries=2)
     finally:
-        _remove_job(job_id)
         processing.clean_workdir(work_dir)